@@ -13,13 +13,84 @@ Usage:
 """
 
 import argparse
+import functools
+import os
+import re
+import shutil
 import subprocess
 import sys
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from pathlib import Path
 from typing import List, Optional, Tuple
 
 import yaml
 
+try:
+    from yaml import CSafeDumper as _YDumper
+except ImportError:
+    from yaml import SafeDumper as _YDumper
+
+# Directory names that are never descended into during script discovery
+PRUNED_DIRS = {
+    "venv",
+    ".venv",
+    "node_modules",
+    "__pycache__",
+    "logs",
+    "build",
+    "dist",
+    "submit",
+}
+
+# Single-call matchers for the discovery walk: hidden or pruned directory names,
+# and ``*.py`` files other than ``__init__.py``
+PRUNE_RE = re.compile(
+    r"\.|(?:{})$".format("|".join(re.escape(name) for name in sorted(PRUNED_DIRS)))
+)
+SCRIPT_RE = re.compile(r"(?!__init__\.py$).+\.py$")
+
+# Execution mode block written to every generated run.yaml (shared, never mutated)
+DEFAULT_MODE_CONFIG = {
+    "slurm": {
+        "pykernel": "singularity exec --bind /mnt:/mnt --nv python.sif bash -c",
+        "template": "./submit/templates/slurm_job.sh.j2",
+    },
+    "cloud_local": {
+        "pykernel": "singularity exec --bind /mnt:/mnt --nv python.sif bash -c",
+        "template": "./submit/templates/cloud_local_job_cmd.j2",
+    },
+    "local": {
+        "pykernel": "python",
+        "template": "./submit/templates/local_job_cmd.j2",
+    },
+}
+
+# Number of threads used for concurrent script discovery
+MAX_SCAN_WORKERS = 8
+
+# Buffered debug messages written at once, so a slow walk still shows progress
+VERBOSE_FLUSH_EVERY = 256
+
+
+@functools.lru_cache(maxsize=1)
+def _has_singularity() -> bool:
+    """Check once per process whether the singularity CLI is on PATH."""
+    return shutil.which("singularity") is not None
+
+
+def _flushes_log(method):
+    """Flush buffered log output when a public entry point returns or raises."""
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self._flush_log()
+
+    return wrapper
+
 
 class SubmitInitializer:
     """Handles the initialization and setup of the submit tool."""
@@ -30,6 +101,7 @@ class SubmitInitializer:
         interactive: bool = True,
         force: bool = False,
         verbose: bool = False,
+        parallel: bool = False,
     ):
         """Initialize the setup handler.
 
@@ -38,11 +110,15 @@ class SubmitInitializer:
             interactive: Whether to prompt for user input
             force: Whether to overwrite existing files
             verbose: Whether to enable verbose logging
+            parallel: Whether to scan directories concurrently during discovery
         """
         self.repo_root = repo_root
+        self._log_buf: List[str] = []
+        self._log_lock = threading.Lock()
         self.interactive = interactive
         self.force = force
         self.verbose = verbose
+        self.parallel = parallel
         self.submit_dir = repo_root / "submit"
 
         # Validate that we're in a submit directory
@@ -58,29 +134,48 @@ class SubmitInitializer:
                 )
                 raise FileNotFoundError(msg)
 
-    def _is_relative_to(self, path: Path, parent: Path) -> bool:
-        """Python 3.6+ compatible version of Path.is_relative_to()."""
-        try:
-            path.relative_to(parent)
-            return True
-        except ValueError:
-            return False
+        # Cache path invariants used repeatedly during setup
+        self._repo_root_abs = str(self.repo_root.absolute())
+        self._submit_prefix = str(self.submit_dir.resolve()) + os.sep
+        self._submit_dir_norm = os.path.normpath(self.submit_dir)
+        self._walk_root = str(self.repo_root)
+        self._root_prefix = os.path.join(self._walk_root, "")
+
+        # Scan the repository root once; top-level existence checks are served
+        # from this name -> is_dir map and kept up to date when files are created
+        with os.scandir(self.repo_root) as it:
+            self._repo_entries = {
+                entry.name: entry.is_dir(follow_symlinks=True) for entry in it
+            }
 
     def log(self, message: str, level: str = "INFO"):
-        """Log a message with appropriate formatting."""
+        """Buffer a log message with appropriate formatting."""
         prefix = f"[{level}]" if level != "INFO" else ""
-        print(f"{prefix} {message}")
+        with self._log_lock:
+            self._log_buf.append(f"{prefix} {message}\n")
+
+    def _flush_log(self):
+        """Write all buffered log messages to stdout in a single call."""
+        # Locked because the parallel discovery walk logs from worker threads
+        with self._log_lock:
+            if self._log_buf:
+                sys.stdout.write("".join(self._log_buf))
+                sys.stdout.flush()
+                self._log_buf.clear()
 
     def verbose_log(self, message: str):
         """Log a verbose message only if verbose mode is enabled."""
         if self.verbose:
             self.log(message, "DEBUG")
+            if len(self._log_buf) >= VERBOSE_FLUSH_EVERY:
+                self._flush_log()
 
     def prompt_yes_no(self, question: str, default: bool = True) -> bool:
         """Prompt user for yes/no input."""
         if not self.interactive:
             return default
 
+        self._flush_log()
         suffix = " [Y/n]" if default else " [y/N]"
         while True:
             response = input(f"{question}{suffix}: ").lower().strip()
@@ -98,6 +193,7 @@ class SubmitInitializer:
         if not self.interactive and default:
             return default
 
+        self._flush_log()
         suffix = f" [{default}]" if default else ""
         response = input(f"{question}{suffix}: ").strip()
         return response if response else default
@@ -107,8 +203,8 @@ class SubmitInitializer:
         config_files = ["pyproject.toml", "setup.py", "setup.cfg"]
 
         for config_file in config_files:
-            config_path = self.repo_root / config_file
-            if config_path.exists():
+            if config_file in self._repo_entries:
+                config_path = self.repo_root / config_file
                 self.log(f"Found Python configuration: {config_path}")
                 return config_path
 
@@ -118,11 +214,20 @@ class SubmitInitializer:
         )
         return None
 
+    def _resolve_install_cmd(self) -> str:
+        """Choose the Singularity %post install command from the repository layout."""
+        # find_python_config is served from the cached root listing (no stat calls)
+        if self.find_python_config():
+            return "python -m pip install --root-user-action=ignore -e ."
+        if "requirements.txt" in self._repo_entries:
+            return "python -m pip install --root-user-action=ignore -r requirements.txt"
+        return "echo 'No package configuration found. Add your install commands here.'"
+
     def create_singularity_def(self) -> Path:
         """Create or update Singularity.def file."""
         singularity_def = self.repo_root / "Singularity.def"
 
-        if singularity_def.exists() and not self.force:
+        if singularity_def.name in self._repo_entries and not self.force:
             if not self.prompt_yes_no(
                 "Singularity.def already exists. Overwrite?", False
             ):
@@ -133,69 +238,139 @@ class SubmitInitializer:
         python_version = self.prompt_input("Python version for container", "3.12")
 
         # Determine installation method
-        config_file = self.find_python_config()
-        if config_file:
-            install_cmd = "python -m pip install --root-user-action=ignore -e ."
-        else:
-            requirements_file = self.repo_root / "requirements.txt"
-            if requirements_file.exists():
-                install_cmd = "python -m pip install --root-user-action=ignore -r requirements.txt"
-            else:
-                install_cmd = "echo 'No package configuration found. Add your install commands here.'"
+        install_cmd = self._resolve_install_cmd()
 
         singularity_content = f"""Bootstrap: docker
 From: python:{python_version}
 
 %post
-    cd {self.repo_root.absolute()}
+    cd {self._repo_root_abs}
     {install_cmd}
     
     # Install additional dependencies if needed
     # python -m pip install --root-user-action=ignore <additional-packages>
 
 %environment
-    export PYTHONPATH="{self.repo_root.absolute()}:$PYTHONPATH"
+    export PYTHONPATH="{self._repo_root_abs}:$PYTHONPATH"
 
 %runscript
     exec "$@"
 """
 
-        singularity_def.write_text(singularity_content)
+        singularity_def.write_text(singularity_content, encoding="utf-8")
+        self._repo_entries[singularity_def.name] = False
         self.log(f"Created {singularity_def}")
 
         if self.interactive:
             self.log(
-                f"Singularity.def configured with repository path: {self.repo_root.absolute()}",
+                f"Singularity.def configured with repository path: {self._repo_root_abs}",
                 "INFO",
             )
 
         return singularity_def
 
+    def _scan_directory(
+        self, path: str, descend: bool = True
+    ) -> Tuple[List[str], List[Tuple[str, Path]]]:
+        """Scan a single directory for subdirectories and scripts.
+
+        Unreadable directories are skipped, like ``Path.glob`` does.
+
+        Args:
+            path: Directory to scan
+            descend: Whether to collect subdirectories to descend into
+
+        Returns:
+            Subdirectories to descend into and scripts found in ``path``
+        """
+        subdirs = []
+        scripts = []
+        # The walk root is never a scripts/ directory, even if it is named so
+        in_scripts_dir = (
+            path != self._walk_root and os.path.basename(path) == "scripts"
+        )
+        # Hoisted so disabled debug messages are never formatted in the loop
+        verbose = self.verbose
+        submit_dir = self._submit_dir_norm
+        root_prefix_len = len(self._root_prefix)
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        if not descend:
+                            continue
+                        if (
+                            PRUNE_RE.match(entry.name)
+                            or os.path.normpath(entry.path) == submit_dir
+                        ):
+                            if verbose:
+                                self.verbose_log(f"Pruned directory: {entry.path}")
+                            continue
+                        subdirs.append(entry.path)
+                    elif descend and entry.name == "scripts" and entry.is_dir():
+                        # Symlinked scripts/ directory: take its scripts but do
+                        # not follow links inside it, so symlink loops cannot recurse
+                        scripts.extend(self._scan_directory(entry.path, False)[1])
+                    elif in_scripts_dir and SCRIPT_RE.match(entry.name):
+                        # Entries are joined onto the walk root, so slicing off
+                        # the root prefix gives the repository-relative path
+                        script_name = entry.name[:-3]
+                        relative_path = Path(entry.path[root_prefix_len:])
+                        if verbose:
+                            self.verbose_log(
+                                f"Added script: {script_name} -> {relative_path}"
+                            )
+                        scripts.append((script_name, relative_path))
+        except OSError as e:
+            self.verbose_log(f"Skipped unreadable directory: {path} ({e})")
+        return subdirs, scripts
+
+    def _walk_scripts(self) -> List[Tuple[str, Path]]:
+        """Walk the repository with os.scandir, pruning irrelevant subtrees."""
+        scripts = []
+        stack = [self._walk_root]
+        while stack:
+            subdirs, found = self._scan_directory(stack.pop())
+            stack.extend(subdirs)
+            scripts.extend(found)
+        return scripts
+
+    def _walk_scripts_parallel(self) -> List[Tuple[str, Path]]:
+        """Walk the repository scanning directories concurrently.
+
+        Overlaps directory listing latency, which helps on network filesystems.
+        """
+        scripts = []
+        with ThreadPoolExecutor(max_workers=MAX_SCAN_WORKERS) as executor:
+            pending = {executor.submit(self._scan_directory, self._walk_root)}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    subdirs, found = future.result()
+                    scripts.extend(found)
+                    pending.update(
+                        executor.submit(self._scan_directory, subdir)
+                        for subdir in subdirs
+                    )
+        return scripts
+
     def discover_python_scripts(self) -> List[Tuple[str, Path]]:
         """Discover Python scripts in scripts/ directories and allow user to add others."""
         discovered_scripts = []
 
         # Look for all scripts directories anywhere in the repo
-        scripts_pattern = "**/scripts/*.py"
-        self.verbose_log(f"Searching for scripts with pattern: {scripts_pattern}")
+        self.verbose_log("Searching for scripts in **/scripts/*.py")
         self.verbose_log(f"Repository root: {self.repo_root}")
         self.verbose_log(f"Submit directory: {self.submit_dir}")
 
-        for script_file in self.repo_root.glob(scripts_pattern):
-            self.verbose_log(f"Found potential script: {script_file}")
-            self.verbose_log(f"  - Is __init__.py? {script_file.name == '__init__.py'}")
-            self.verbose_log(
-                f"  - Is in submit dir? {self._is_relative_to(script_file, self.submit_dir)}"
-            )
-            if script_file.name != "__init__.py" and not self._is_relative_to(
-                script_file, self.submit_dir
-            ):
-                script_name = script_file.stem
-                relative_path = script_file.relative_to(self.repo_root)
-                self.verbose_log(f"  - Added script: {script_name} -> {relative_path}")
-                discovered_scripts.append((script_name, relative_path))
-            else:
-                self.verbose_log(f"  - Skipped: {script_file.name}")
+        if self.parallel:
+            discovered_scripts.extend(self._walk_scripts_parallel())
+        else:
+            discovered_scripts.extend(self._walk_scripts())
+        # Walk order depends on the filesystem (and on thread completion when
+        # parallel), sort so run.yaml is the same either way
+        discovered_scripts.sort(key=lambda script: script[1])
+        self._flush_log()
 
         # In interactive mode, ask user to add additional scripts
         if self.interactive:
@@ -222,7 +397,7 @@ From: python:{python_version}
                     self.log(f"Not a Python file: {script_path}", "WARNING")
                     continue
 
-                if self._is_relative_to(full_script_path, self.submit_dir):
+                if str(full_script_path.resolve()).startswith(self._submit_prefix):
                     self.log(
                         f"Skipping file in submit directory: {script_path}", "WARNING"
                     )
@@ -249,6 +424,7 @@ From: python:{python_version}
                 self.log(f"Added script: {custom_name} -> {script_path}")
 
         self.verbose_log(f"Total discovered scripts: {len(discovered_scripts)}")
+        self._flush_log()
         return discovered_scripts
 
     def create_run_yaml(self) -> Path:
@@ -264,27 +440,13 @@ From: python:{python_version}
         discovered_scripts = self.discover_python_scripts()
 
         self.log(f"Discovered {len(discovered_scripts)} Python scripts")
-        for name, path in discovered_scripts:
-            self.log(f"  - {name}: {path}")
+        with self._log_lock:
+            self._log_buf.extend(
+                f"   - {name}: {path}\n" for name, path in discovered_scripts
+            )
 
         # Build configuration
-        config = {
-            "mode": {
-                "slurm": {
-                    "pykernel": "singularity exec --bind /mnt:/mnt --nv python.sif bash -c",
-                    "template": "./submit/templates/slurm_job.sh.j2",
-                },
-                "cloud_local": {
-                    "pykernel": "singularity exec --bind /mnt:/mnt --nv python.sif bash -c",
-                    "template": "./submit/templates/cloud_local_job_cmd.j2",
-                },
-                "local": {
-                    "pykernel": "python",
-                    "template": "./submit/templates/local_job_cmd.j2",
-                },
-            },
-            "scripts": {},
-        }
+        config = {"mode": DEFAULT_MODE_CONFIG, "scripts": {}}
 
         # Add discovered scripts
         for script_name, script_path in discovered_scripts:
@@ -309,8 +471,15 @@ From: python:{python_version}
             )
 
         # Write configuration
-        with run_yaml_path.open("w") as f:
-            yaml.dump(config, f, default_flow_style=False)
+        with run_yaml_path.open("wb") as f:
+            yaml.dump(
+                config,
+                f,
+                Dumper=_YDumper,
+                default_flow_style=False,
+                sort_keys=False,
+                encoding="utf-8",
+            )
 
         self.log(f"Created {run_yaml_path}")
         return run_yaml_path
@@ -318,7 +487,12 @@ From: python:{python_version}
     def setup_logging_directory(self) -> Path:
         """Create logs directory."""
         logs_dir = self.repo_root / "logs"
+        if self._repo_entries.get(logs_dir.name):
+            self.log(f"Using existing logs directory: {logs_dir}")
+            return logs_dir
+
         logs_dir.mkdir(exist_ok=True)
+        self._repo_entries[logs_dir.name] = True
         self.log(f"Created logs directory: {logs_dir}")
         return logs_dir
 
@@ -348,28 +522,27 @@ echo "Container build complete!"
 echo "You can now run jobs with: python submit/submit.py --mode cloud_local --script <script_name>"
 """
 
-        build_script.write_text(build_content)
+        build_script.write_text(build_content, encoding="utf-8")
         build_script.chmod(0o755)
+        self._repo_entries[build_script.name] = False
         self.log(f"Created build script: {build_script}")
         return build_script
 
     def build_container_with_script(self) -> bool:
         """Build the Singularity container using the build script."""
-        build_script = self.repo_root / "build_container.sh"
+        build_script = Path(self._repo_root_abs) / "build_container.sh"
 
-        if not build_script.exists():
+        if build_script.name not in self._repo_entries:
             self.log("Build script not found. Cannot build container.", "WARNING")
             return False
 
         try:
             self.log("Building Singularity container using build script...")
             self.log("This may take several minutes...")
+            self._flush_log()
 
-            # Run the build script
-            result = subprocess.run(
-                ["bash", str(build_script)],
-                cwd=self.repo_root,
-            )
+            # Run through bash so a noexec mount does not stop the build
+            result = subprocess.run(["bash", str(build_script)], cwd=self.repo_root)
 
             if result.returncode == 0:
                 self.log("Container build completed successfully!", "INFO")
@@ -399,16 +572,10 @@ echo "You can now run jobs with: python submit/submit.py --mode cloud_local --sc
             )
         else:
             # In non-interactive mode, try to build if Singularity is available
-            try:
-                subprocess.run(
-                    ["singularity", "--version"],
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    check=True,
-                )
+            if _has_singularity():
                 self.log("Singularity detected. Building container automatically...")
                 build_container = True
-            except (FileNotFoundError, subprocess.CalledProcessError):
+            else:
                 self.log(
                     "Singularity not available. Skipping container build.", "WARNING"
                 )
@@ -418,6 +585,7 @@ echo "You can now run jobs with: python submit/submit.py --mode cloud_local --sc
             return self.build_container_with_script()
         return False
 
+    @_flushes_log
     def run_setup(self):
         """Run the complete setup process."""
         self.log(
@@ -431,18 +599,22 @@ echo "You can now run jobs with: python submit/submit.py --mode cloud_local --sc
         # Create Singularity definition
         self.log("\n1. Setting up Singularity container configuration...")
         singularity_def = self.create_singularity_def()
+        self._flush_log()
 
         # Create run.yaml
         self.log("\n2. Creating run.yaml configuration...")
         run_yaml = self.create_run_yaml()
+        self._flush_log()
 
         # Setup logging
         self.log("\n3. Setting up logging directory...")
         logs_dir = self.setup_logging_directory()
+        self._flush_log()
 
         # Create build script
         self.log("\n4. Creating container build script...")
         build_script = self.create_build_script()
+        self._flush_log()
 
         # Summary
         self.log("\n" + "=" * 60)
@@ -451,6 +623,7 @@ echo "You can now run jobs with: python submit/submit.py --mode cloud_local --sc
         self.log(f"  - {run_yaml}")
         self.log(f"  - {logs_dir}/")
         self.log(f"  - {build_script}")
+        self._flush_log()
 
         # Container building
         self.log("\n5. Building Singularity container...")
@@ -479,6 +652,7 @@ echo "You can now run jobs with: python submit/submit.py --mode cloud_local --sc
                 "4. Use SLURM: python submit/submit.py --mode slurm --script <script_name>"
             )
 
+    @_flushes_log
     def rebuild_yaml_only(self):
         """Rebuild only the run.yaml file by rediscovering scripts."""
         self.log(
@@ -497,6 +671,7 @@ echo "You can now run jobs with: python submit/submit.py --mode cloud_local --sc
         self.log(f"Updated: {run_yaml}")
         self.log("You can now run jobs with your rediscovered scripts.")
 
+    @_flushes_log
     def rebuild_singularity_only(self):
         """Rebuild only the Singularity.def file and build script."""
         self.log(
@@ -562,6 +737,11 @@ def main():
         action="store_true",
         help="Enable verbose logging for debugging",
     )
+    parser.add_argument(
+        "--parallel",
+        action="store_true",
+        help="Scan directories concurrently during script discovery (faster on network filesystems)",
+    )
 
     args = parser.parse_args()
 
@@ -571,6 +751,7 @@ def main():
             interactive=not args.non_interactive,
             force=args.force,
             verbose=args.verbose,
+            parallel=args.parallel,
         )
 
         if args.run_yaml_only:
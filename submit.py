@@ -1,16 +1,50 @@
 """Submit jobs with various arguments to SLURM or to run locally."""
 
 import argparse
-import datetime
+import functools
+import os
+import re
+import shlex
+import shutil
 import subprocess
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
-from itertools import product
+from functools import reduce
+from itertools import groupby, product
+from operator import mul
 from pathlib import Path
-from typing import Union
+from typing import List, Optional, Tuple, Union
 
 import yaml
-from jinja2 import Template
+from jinja2 import Environment, FileSystemLoader, Template
+
+try:
+    from yaml import CSafeLoader as _YLoader
+except ImportError:
+    from yaml import SafeLoader as _YLoader
+
+# Resolve sbatch once per process instead of searching $PATH on every submit
+_SBATCH_PATH: Optional[str] = shutil.which("sbatch")
+
+# Number of bytes read from a local job's output pipe at once
+READ_CHUNK_SIZE = 1 << 16
+
+# Number of concurrent sbatch calls when not submitting a job array
+MAX_SUBMIT_WORKERS = 16
+
+# Tasks per job array; Slurm's default MaxArraySize of 1001 allows indices 0-1000
+MAX_ARRAY_SIZE = 1000
+
+# Log file options of an array script, split into option, file pattern and rest
+_ARRAY_LOG_RE = re.compile(r"^(#SBATCH\s+(?:--output|--error|-o|-e)[=\s]\s*)(\S+)(.*)$")
+
+# Characters that make a command line depend on the shell
+_SHELL_META_RE = re.compile(r"[|&;<>()$`\\*?~\[\]{}!#\n]")
+
+# Shared environment for templates given as strings
+_JINJA_ENV = Environment(auto_reload=False, cache_size=-1)
 
 
 class ExecutionMode(Enum):
@@ -33,14 +67,98 @@ class ExecutionMode(Enum):
         Raises:
             ValueError: If the string doesn't match any enum value
         """
-        try:
-            return cls(value)
-        except ValueError as err:
+        mode = _MODE_MAP.get(value)
+        if mode is None:
             msg = (
                 f"Invalid execution mode: {value}. "
-                f"Must be one of {[m.value for m in cls]}"
+                f"Must be one of {list(_MODE_MAP)}"
             )
-            raise ValueError(msg) from err
+            raise ValueError(msg)
+        return mode
+
+
+# Value -> member lookup table for ExecutionMode.from_str
+_MODE_MAP = {m.value: m for m in ExecutionMode}
+
+
+@functools.lru_cache(maxsize=None)
+def _get_environment(template_dir: str) -> Environment:
+    """Create one Jinja2 environment per template directory."""
+    return Environment(
+        loader=FileSystemLoader(template_dir),
+        auto_reload=False,
+        cache_size=-1,
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def _get_template(path_str: str) -> Template:
+    """Load and compile a template file once per process.
+
+    Args:
+        path_str: Path to the template file
+
+    Returns:
+        Compiled Jinja2 template
+    """
+    path = Path(path_str)
+    return _get_environment(str(path.parent)).get_template(path.name)
+
+
+@functools.lru_cache(maxsize=None)
+def _compile_template(source: str) -> Template:
+    """Compile a template string once per process."""
+    return _JINJA_ENV.from_string(source)
+
+
+# Directories already created by this process, see _ensure_dir
+_MKDIR_CACHE = set()
+
+
+def _ensure_dir(path: Path) -> None:
+    """Create a directory (and parents) once per process."""
+    if path not in _MKDIR_CACHE:
+        path.mkdir(parents=True, exist_ok=True)
+        _MKDIR_CACHE.add(path)
+
+
+def _load_template(cmd_template: Union[str, Path]) -> Template:
+    """Get the compiled template for a template string or template file path."""
+    if isinstance(cmd_template, Path):
+        return _get_template(str(cmd_template))
+    return _compile_template(cmd_template)
+
+
+def _split_command(cmd_str: str) -> Optional[Tuple[str, List[str]]]:
+    """Split a command line for direct execution without a shell.
+
+    Args:
+        cmd_str: Rendered command line
+
+    Returns:
+        The program resolved on $PATH and the unchanged argument vector, or
+        None if the command relies on shell features (operators, expansions,
+        builtins, variable assignments) and must run through ``/bin/sh``
+    """
+    if _SHELL_META_RE.search(cmd_str):
+        return None
+    try:
+        argv = shlex.split(cmd_str)
+    except ValueError:
+        return None
+    if not argv or "=" in argv[0]:
+        return None
+    program = shutil.which(argv[0])
+    if program is None:
+        return None
+    return program, argv
+
+
+def _write_all(fd: int, data: bytes) -> None:
+    """Write all of ``data`` to ``fd``, retrying after short writes."""
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view) :]
 
 
 class LocalJob:
@@ -61,20 +179,14 @@ class LocalJob:
             template_vars: Variables to substitute in the template
             log_path: Directory to store log files
         """
-        self._cmd_template = cmd_template
+        self._cmd_template = _load_template(cmd_template)
         self._template_vars = template_vars or {}
         self._job_name = job_name
         self._log_path = log_path
 
     def _render_cmd(self):
         """Render the command template with the provided variables."""
-        if isinstance(self._cmd_template, Path):
-            template_str = self._cmd_template.read_text()
-        else:
-            template_str = self._cmd_template
-
-        template = Template(template_str)
-        return template.render(**self._template_vars)
+        return self._cmd_template.render(**self._template_vars)
 
     def submit(self) -> None:
         """Execute the job locally and log its output."""
@@ -82,40 +194,57 @@ class LocalJob:
         cmd_str = self._render_cmd()
 
         # Setup log file
-        self._log_path.mkdir(parents=True, exist_ok=True)
-        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        _ensure_dir(self._log_path)
+        # A monotonic suffix keeps names unique for jobs started in the same second
+        timestamp = time.strftime("%Y%m%d_%H%M%S")
+        timestamp += f"_{int(time.monotonic() * 1e9) & 0xFFFFFF:06x}"
         log_file = self._log_path / f"{timestamp}_{self._job_name}.out"
 
         print(f"Running job '{self._job_name}' locally")
         print(f"Command: {cmd_str}")
         print(f"Logging to: {log_file}")
 
-        with log_file.open("w") as f:
-            f.write(f"Job Name: {self._job_name}\n")
-            f.write(f"Command: {cmd_str}\n")
-            f.write("-" * 80 + "\n\n")
+        # Log through a raw fd: every chunk is one write() straight to the file,
+        # so the log is always current without any flush calls
+        log_fd = os.open(str(log_file), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            header = f"Job Name: {self._job_name}\nCommand: {cmd_str}\n" + "-" * 80
+            _write_all(log_fd, (header + "\n\n").encode())
+            # Exec the command directly unless it needs shell features. The
+            # executable path is absolute and close_fds=False, which lets CPython
+            # start it with posix_spawn instead of fork+exec (our own files are
+            # opened non-inheritable, so nothing leaks into the child). argv[0]
+            # stays as written, like the shell would pass it
+            command = _split_command(cmd_str)
+            program, argv = (None, cmd_str) if command is None else command
             process = subprocess.Popen(
-                cmd_str,
-                shell=True,
+                argv,
+                executable=program,
+                shell=program is None,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.STDOUT,
-                universal_newlines=True,
-                bufsize=1,
+                close_fds=False,
             )
+            # Copy raw output chunks to the terminal and the log, no per-line work
+            sys.stdout.flush()
+            stdout = sys.stdout.buffer
+            fd = process.stdout.fileno()
             while True:
-                line = process.stdout.readline()
-                # in text mode, readline() returns "" on EOF
-                if line == "" and process.poll() is not None:
+                chunk = os.read(fd, READ_CHUNK_SIZE)
+                # os.read() returns b"" once the child closed its output
+                if not chunk:
                     break
-                if line:
-                    line = line.rstrip()
-                    print(line)
-                    f.write(line + "\n")
-                    f.flush()
-            return_code = process.poll()
-            if return_code != 0:
-                print(f"Job failed with return code {return_code}", file=sys.stderr)
-                sys.exit(return_code)
+                stdout.write(chunk)
+                stdout.flush()
+                _write_all(log_fd, chunk)
+            process.stdout.close()
+            return_code = process.wait()
+        finally:
+            os.close(log_fd)
+
+        if return_code != 0:
+            print(f"Job failed with return code {return_code}", file=sys.stderr)
+            sys.exit(return_code)
 
 
 class SlurmJob:
@@ -136,32 +265,139 @@ class SlurmJob:
             template_vars: Variables to substitute in the template
             log_path: Directory to store log files
         """
-        self._template = cmd_template
+        self._template = _load_template(cmd_template)
         self._vars = template_vars
         self._job_name = job_name
         self._log_path = log_path
 
     def _render(self) -> str:
         """Render the SLURM script template with the provided variables."""
-        tpl = (
-            Path(self._template).read_text()
-            if isinstance(self._template, Path)
-            else self._template
-        )
-        return Template(tpl).render(job_name=self._job_name, **self._vars)
+        return self._template.render(job_name=self._job_name, **self._vars)
 
     def submit(self) -> None:
         """Submit the job to the SLURM scheduler."""
         # ensure log dir exists (for SBATCH --output=...)
-        self._log_path.mkdir(parents=True, exist_ok=True)
+        _ensure_dir(self._log_path)
+
+        if _SBATCH_PATH is None:
+            msg = "sbatch not found on PATH. Cannot submit SLURM jobs."
+            raise FileNotFoundError(msg)
+
+        # sbatch reads the script from stdin, no temporary file needed
+        # close_fds=False lets CPython use posix_spawn for the submission
+        subprocess.run(
+            [_SBATCH_PATH, "--job-name", self._job_name],
+            input=self._render(),
+            universal_newlines=True,
+            check=True,
+            close_fds=False,
+        )
+
+
+def _split_sbatch_header(script: str) -> Tuple[List[str], str]:
+    """Split a rendered SLURM script into its header and body.
+
+    The header is the leading block of blank and comment lines (shebang and
+    ``#SBATCH`` directives), i.e. everything sbatch parses options from.
+
+    Args:
+        script: Rendered SLURM script
+
+    Returns:
+        Header lines and the remaining script body
+    """
+    lines = script.splitlines()
+    idx = 0
+    while idx < len(lines) and (not lines[idx].strip() or lines[idx].startswith("#")):
+        idx += 1
+    return lines[:idx], "\n".join(lines[idx:])
+
+
+def _array_log_option(line: str) -> str:
+    """Make an ``#SBATCH`` log file option unique per array task.
+
+    ``%j`` becomes ``%A_%a``; patterns without any job id get ``_%A_%a``
+    before their extension, since every task would otherwise share the file.
+
+    Args:
+        line: Header line of the array script
 
-        script_fp = Path(f"{self._job_name}.slurm.sh")
-        script_fp.write_text(self._render())
-        script_fp.chmod(0o700)
+    Returns:
+        The line with a per-task log file pattern
+    """
+    match = _ARRAY_LOG_RE.match(line)
+    if match is None:
+        return line
+    option, pattern, rest = match.groups()
+    if "%A" in pattern or "%a" in pattern:
+        return line
+    if "%j" in pattern:
+        pattern = pattern.replace("%j", "%A_%a")
+    else:
+        root, ext = os.path.splitext(pattern)
+        pattern = f"{root}_%A_%a{ext}"
+    return f"{option}{pattern}{rest}"
+
+
+class SlurmArrayJob(SlurmJob):
+    """Class for submitting several SLURM jobs as a single job array."""
+
+    def __init__(
+        self,
+        jobs: List[SlurmJob],
+        job_name: str,
+        log_path: Path = Path("logs"),
+    ) -> None:
+        """Initialize a SLURM job array.
+
+        Args:
+            jobs: Jobs to run as array tasks, in task id order
+            job_name: Name of the job array
+            log_path: Directory to store log files
+        """
+        super().__init__(
+            cmd_template="", job_name=job_name, template_vars={}, log_path=log_path
+        )
+        # Per-job #SBATCH headers (without the job name) and script bodies
+        self._headers = []
+        self._bodies = []
+        for job in jobs:
+            header, body = _split_sbatch_header(job._render())
+            self._headers.append(
+                [line for line in header if not line.startswith("#SBATCH --job-name")]
+            )
+            # Name the combination in the task log, the log file name cannot
+            self._bodies.append(f"echo {shlex.quote(job._job_name)}\n{body}")
+
+    def is_uniform(self) -> bool:
+        """Check whether all jobs share the same SLURM options.
+
+        A job array has a single header, so jobs whose ``#SBATCH`` directives
+        differ (e.g. a template that uses script arguments in them) cannot be
+        merged and must be submitted individually.
+        """
+        return all(header == self._headers[0] for header in self._headers)
 
-        # submit and clean up
-        subprocess.run(["sbatch", str(script_fp)], check=True)
-        script_fp.unlink()
+    def _render(self) -> str:
+        """Render one script that runs the body of job i as array task i."""
+        header = self._headers[0]
+        lines = [line for line in header if line.startswith("#!")]
+        lines.append(f"#SBATCH --job-name={self._job_name}")
+        lines.extend(
+            _array_log_option(line)
+            for line in header
+            if not line.startswith("#!")
+        )
+        while not lines[-1].strip():
+            lines.pop()
+        lines.append(f"#SBATCH --array=0-{len(self._bodies) - 1}")
+        lines.append("")
+        lines.append('case "$SLURM_ARRAY_TASK_ID" in')
+        lines.extend(
+            f"{task_id})\n{body}\n;;" for task_id, body in enumerate(self._bodies)
+        )
+        lines.append("esac")
+        return "\n".join(lines) + "\n"
 
 
 JOB_OPTIONS = {
@@ -171,9 +407,47 @@ JOB_OPTIONS = {
 }
 
 
+# Translation table used by arg_to_string
+_SLUG_TABLE = str.maketrans("/", "-")
+
+
 def arg_to_string(val):
     """Turn argument to string without backslash"""
-    return str(val).replace("/", "-")
+    return str(val).translate(_SLUG_TABLE)
+
+
+# Parsed configs keyed by (path, mtime_ns), see _load_config
+_CONFIG_CACHE = {}
+
+
+def _load_config(config_file: Path) -> dict:
+    """Load a YAML config file, reusing the parsed result while it is unchanged.
+
+    The returned dict is shared between calls and must not be mutated.
+
+    Args:
+        config_file: Path to the YAML config file
+
+    Returns:
+        Parsed configuration
+    """
+    key = (str(config_file), config_file.stat().st_mtime_ns)
+    config = _CONFIG_CACHE.get(key)
+    if config is None:
+        with config_file.open("r") as f:
+            config = yaml.load(f, Loader=_YLoader)
+        _CONFIG_CACHE[key] = config
+    return config
+
+
+def _as_list(val) -> list:
+    """Wrap a default argument value in a list unless it already is one."""
+    val_type = type(val)
+    if val_type is list:
+        return val
+    if val_type is tuple:
+        return list(val)
+    return [val]
 
 
 def main() -> None:
@@ -218,6 +492,11 @@ def main() -> None:
         default="./logs",
         help="Log directory for slurm job.",
     )
+    parser.add_argument(
+        "--no-array",
+        action="store_true",
+        help="Submit one sbatch job per combination instead of a single job array.",
+    )
 
     # Split off any --key value1 value2 ... into `unknown`
     args, unknown = parser.parse_known_args()
@@ -240,8 +519,7 @@ def main() -> None:
         mode_specific_overrides = {}
 
     # Load YAML config
-    with args.config_file.open("r") as f:
-        config = yaml.safe_load(f)
+    config = _load_config(args.config_file)
 
     # Grab the right mode-block
     mode_cfg = config["mode"][args.mode.value]
@@ -254,29 +532,27 @@ def main() -> None:
     default_args = script_cfg.get("default_args", {})
 
     # Combine variables to create job arrays
-    extra_args = {k: v if isinstance(v, list) else [v] for k, v in default_args.items()}
-    i = 0
-    while i < len(unknown):
-        tok = unknown[i]
-        if not tok.startswith("--"):
-            parser.error(f"Unexpected token {tok!r}")
-        key = tok.lstrip("--")
-        i += 1
-        vals = []
-        # consume until next --foo or end
-        while i < len(unknown) and not unknown[i].startswith("--"):
-            vals.append(unknown[i])
-            i += 1
-        if not vals:
-            parser.error(f"No values provided for argument --{key}")
-        extra_args[key] = vals
+    extra_args = {k: _as_list(v) for k, v in default_args.items()}
+    # Group the tokens into alternating runs of --flags and their values
+    groups = [
+        (is_flag, list(tokens))
+        for is_flag, tokens in groupby(unknown, key=lambda t: t.startswith("--"))
+    ]
+    if groups and not groups[0][0]:
+        parser.error(f"Unexpected token {groups[0][1][0]!r}")
+    for idx in range(0, len(groups), 2):
+        flags = groups[idx][1]
+        # consecutive flags or a trailing flag mean a flag without values
+        if len(flags) > 1 or idx + 1 == len(groups):
+            parser.error(f"No values provided for argument --{flags[0].lstrip('--')}")
+        extra_args[flags[0].lstrip("--")] = groups[idx + 1][1]
 
     # Build cartesian product of all key-values
     keys = list(extra_args.keys())
     all_values = [extra_args[k] for k in keys]
 
     # Show job creation details
-    total_jobs = len(list(product(*all_values)))
+    total_jobs = reduce(mul, (len(v) for v in all_values), 1)
     print(f"Creating {total_jobs} job(s) with the following parameters:")
     if keys:
         for key, values in extra_args.items():
@@ -287,34 +563,90 @@ def main() -> None:
         print("  (no parameters specified)")
         print()
 
-    for combo in product(*all_values):
+    # Sweeps on SLURM are submitted as one job array (a single sbatch call)
+    use_array = (
+        args.mode == ExecutionMode.SLURM and not args.no_array and total_jobs > 1
+    )
+    slurm_jobs = []
+
+    # Keys are the same for every combination, escape them once
+    escaped_keys = [arg_to_string(k) for k in keys]
+
+    # Every job uses the same template, read it once for the whole sweep
+    template_text = template_fp.read_text()
+
+    # Vars that go into Jinja and do not depend on the combination
+    base_template_vars = {
+        "pykernel": pykernel,
+        "script_path": str(script_path),
+    }
+    # Add mode specific arguments
+    base_template_vars.update(
+        {k: v for k, v in mode_specific_overrides.items() if v is not None}
+    )
+
+    # Most invocations are a single job, which needs no cartesian product
+    if total_jobs == 1:
+        combos = [tuple(values[0] for values in all_values)]
+    else:
+        combos = product(*all_values)
+
+    for combo in combos:
         # combo is a tuple like ("value1_for_key1", "value_for_key2", ...)
         combo_dict = dict(zip(keys, combo))
 
         # Prepare the vars that go into Jinja
-        template_vars = {
-            "pykernel": pykernel,
-            "script_path": str(script_path),
-            "script_args": combo_dict,
-        }
-
-        # Add mode specific arguments
-        template_vars.update(
-            {k: v for k, v in mode_specific_overrides.items() if v is not None}
-        )
+        template_vars = dict(base_template_vars, script_args=combo_dict)
 
         # instantiate and submit
         suffix = "_".join(
-            f"{arg_to_string(k)}={arg_to_string(v)}" for k, v in combo_dict.items()
+            f"{ek}={arg_to_string(v)}" for ek, v in zip(escaped_keys, combo)
         )
         name = args.script if not suffix else f"{args.script}_{suffix}"
 
         job = JOB_OPTIONS[args.mode](
-            cmd_template=template_fp, job_name=name, template_vars=template_vars
+            cmd_template=template_text, job_name=name, template_vars=template_vars
         )
-        job.submit()
-
-    print(f"Submitted {total_jobs} job(s)")
+        if args.mode == ExecutionMode.SLURM:
+            slurm_jobs.append(job)
+        else:
+            job.submit()
+
+    num_arrays = 0
+    if use_array:
+        # Sweeps above MaxArraySize are split into several arrays; chunks
+        # whose SLURM options differ fall back to one job per combination
+        pending_jobs = []
+        for start in range(0, len(slurm_jobs), MAX_ARRAY_SIZE):
+            chunk = slurm_jobs[start : start + MAX_ARRAY_SIZE]
+            if len(chunk) > 1:
+                array_job = SlurmArrayJob(chunk, job_name=args.script)
+                if array_job.is_uniform():
+                    array_job.submit()
+                    num_arrays += 1
+                    continue
+                print(
+                    "SLURM options differ between combinations, "
+                    "submitting jobs one by one"
+                )
+            pending_jobs.extend(chunk)
+        slurm_jobs = pending_jobs
+
+    # sbatch calls are independent and mostly wait on the controller, so
+    # overlap them; local jobs above run one after another
+    if len(slurm_jobs) == 1:
+        slurm_jobs[0].submit()
+    elif slurm_jobs:
+        workers = min(MAX_SUBMIT_WORKERS, len(slurm_jobs))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(SlurmJob.submit, slurm_jobs))
+    if num_arrays:
+        print(
+            f"Submitted {total_jobs} job(s), {num_arrays} job array(s) "
+            f"named '{args.script}'"
+        )
+    else:
+        print(f"Submitted {total_jobs} job(s)")
 
 
 if __name__ == "__main__":